@@ -4,11 +4,11 @@
 """
 
 # 导入必要的库
+import asyncio
 import os
 from typing import Annotated
 from typing_extensions import TypedDict
 from dotenv import load_dotenv
-from IPython.display import Image, display
 
 # 导入LangGraph相关组件
 from langgraph.graph import StateGraph
@@ -40,9 +40,9 @@ llm = ChatOpenAI(
 )
 
 
-def chatbot(state: State):
+async def chatbot(state: State):
     """
-    聊天机器人节点函数
+    聊天机器人节点函数（异步，避免阻塞事件循环）
 
     参数:
         state: 当前状态，包含消息历史
@@ -50,7 +50,7 @@ def chatbot(state: State):
     返回:
         包含新消息的状态更新
     """
-    return {"messages": [llm.invoke(state["messages"])]}
+    return {"messages": [await llm.ainvoke(state["messages"])]}
 
 
 # 构建图结构
@@ -66,26 +66,36 @@ graph = graph_builder.compile()
 
 # 尝试显示图的可视化（需要额外依赖，可选功能）
 try:
+    # 按需导入IPython，避免普通命令行运行时加载其整个子系统
+    from IPython.display import Image, display
+
     display(Image(graph.get_graph().draw_mermaid_png()))
 except Exception:
     # 如果无法显示图，则忽略错误
     pass
 
 
-def stream_graph_updates(user_input: str):
+async def stream_graph_updates(user_input: str):
     """
     流式处理用户输入并获取助手回复
 
     参数:
         user_input: 用户输入的文本
     """
-    for event in graph.stream({"messages": [{"role": "user", "content": user_input}]}):
-        for value in event.values():
-            print("Assistant:", value["messages"][-1].content)
+    print("Assistant: ", end="", flush=True)
+    # stream_mode="messages"会在LLM生成token时逐块返回，无需等待整条回复完成
+    async for chunk, _ in graph.astream(
+        {"messages": [{"role": "user", "content": user_input}]},
+        stream_mode="messages",
+    ):
+        print(chunk.content, end="", flush=True)
+    print()
 
 
-# 主交互循环
-if __name__ == "__main__":
+async def main():
+    """
+    主交互循环，所有轮次共用同一个事件循环
+    """
     print("欢迎使用基于LangGraph的聊天机器人！输入'quit'、'exit'或'q'退出。")
 
     while True:
@@ -99,10 +109,14 @@ if __name__ == "__main__":
                 break
 
             # 处理用户输入并显示回复
-            stream_graph_updates(user_input)
+            await stream_graph_updates(user_input)
         except:
             # 如果input()不可用，使用默认输入（用于Jupyter环境等）
             user_input = "What do you know about LangGraph?"
             print("User: " + user_input)
-            stream_graph_updates(user_input)
+            await stream_graph_updates(user_input)
             break
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
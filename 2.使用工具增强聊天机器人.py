@@ -5,12 +5,13 @@
 基于LangGraph框架实现，集成了Tavily搜索工具
 """
 
+import asyncio
 from typing import Annotated, Dict, List, Any
 
+import httpx
 from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
 from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import AIMessageChunk, BaseMessage
 from typing_extensions import TypedDict
 
 from langgraph.graph import StateGraph
@@ -22,33 +23,45 @@ import os
 load_dotenv()
 
 
+# 消息类型对应的(颜色, 角色名)，在模块加载时构建一次
+_ROLE_STYLES = {
+    "human": ("\033[94m", "User"),        # 蓝色
+    "ai": ("\033[92m", "Assistant"),      # 绿色
+    "tool": ("\033[93m", "Tool"),         # 黄色
+}
+
+
 def pretty_print(messages: List[BaseMessage]) -> None:
     """优化后的对话打印函数"""
     for msg in messages:
-        role = {
-            "human": "User",
-            "ai": "Assistant",
-            "tool": "Tool"
-        }.get(msg.type, msg.type.capitalize())
-
-        color = {
-            "User": "\033[94m",     # 蓝色
-            "Assistant": "\033[92m",  # 绿色
-            "Tool": "\033[93m"      # 黄色
-        }.get(role, "\033[0m")
+        color, role = _ROLE_STYLES.get(msg.type, ("\033[0m", msg.type.capitalize()))
 
         content = msg.content
-        if hasattr(msg, 'tool_calls'):
-            content += f"\nTool Calls: {msg.tool_calls}"
+        tool_calls = getattr(msg, "tool_calls", None)
+        if tool_calls:
+            content += f"\nTool Calls: {tool_calls}"
 
         print(f"{color}{role}:\033[0m {content}")
 
 
+# 模型配置在模块加载时读取一次
+ZHIPU_MODEL = os.getenv("ZHIPU_MODEL")
+ZHIPU_API_KEY = os.getenv("ZHIPU_API_KEY")
+ZHIPU_API_URL = os.getenv("ZHIPU_API_URL")
+
+# 复用同一组HTTP客户端，保持到模型服务的长连接
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=100)
+http_client = httpx.Client(limits=HTTP_LIMITS, timeout=60.0)
+http_async_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=60.0)
+
+
 def get_llm():
     return ChatOpenAI(
-        model=os.getenv("ZHIPU_MODEL"),
-        openai_api_key=os.getenv("ZHIPU_API_KEY"),
-        openai_api_base=os.getenv("ZHIPU_API_URL"),
+        model=ZHIPU_MODEL,
+        openai_api_key=ZHIPU_API_KEY,
+        openai_api_base=ZHIPU_API_URL,
+        http_client=http_client,
+        http_async_client=http_async_client,
     )
 
 
@@ -62,6 +75,11 @@ class State(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
 
 
+# 配置搜索工具并绑定到LLM模型（与请求无关，只需初始化一次）
+tools = [TavilySearchResults(max_results=2)]
+llm_with_tools = get_llm().bind_tools(tools)
+
+
 def create_chatbot_graph() -> Any:
     """
     创建并配置聊天机器人图
@@ -72,16 +90,8 @@ def create_chatbot_graph() -> Any:
     # 初始化图构建器
     graph_builder = StateGraph(State)
 
-    # 配置搜索工具
-    tool = TavilySearchResults(max_results=2)
-    tools = [tool]
-
-    # 初始化LLM模型
-    llm = get_llm()
-    llm_with_tools = llm.bind_tools(tools)
-
     # 定义聊天机器人节点函数
-    def chatbot(state: State) -> Dict[str, List[BaseMessage]]:
+    async def chatbot(state: State) -> Dict[str, List[BaseMessage]]:
         """
         聊天机器人节点函数，处理用户输入并生成回复
 
@@ -91,13 +101,13 @@ def create_chatbot_graph() -> Any:
         返回:
             包含新消息的字典
         """
-        return {"messages": [llm_with_tools.invoke(state["messages"])]}
+        return {"messages": [await llm_with_tools.ainvoke(state["messages"])]}
 
     # 添加聊天机器人节点
     graph_builder.add_node("chatbot", chatbot)
 
     # 添加工具节点
-    tool_node = ToolNode(tools=[tool])
+    tool_node = ToolNode(tools=tools)
     graph_builder.add_node("tools", tool_node)
 
     # 添加条件边：当需要工具时从聊天机器人到工具
@@ -119,21 +129,29 @@ def create_chatbot_graph() -> Any:
     return graph_builder.compile()
 
 
-def stream_graph_updates(user_input: str):
+# 编译后的图可重复使用，在模块加载时创建一次
+graph = create_chatbot_graph()
+
+
+async def stream_graph_updates(user_input: str):
     """
     流式处理用户输入并获取助手回复
 
     参数:
         user_input: 用户输入的文本
     """
-
-    # 创建聊天机器人图
-    graph = create_chatbot_graph()
-    for events in graph.stream({"messages": [{"role": "user", "content": user_input}]}):
-        for value in events.values():
-            print("Assistant:", value["messages"][-1].content)
+    # stream_mode="messages"会在LLM生成token时逐块返回，工具返回的消息不输出
+    events = graph.astream(
+        {"messages": [{"role": "user", "content": user_input}]},
+        stream_mode="messages",
+    )
+    print("Assistant: ", end="", flush=True)
+    async for chunk, _ in events:
+        if isinstance(chunk, AIMessageChunk):
+            print(chunk.content, end="", flush=True)
+    print()
 
 
 # 主交互循环
 if __name__ == "__main__":
-    stream_graph_updates("特斯拉最新股价多少？")
+    asyncio.run(stream_graph_updates("特斯拉最新股价多少？"))
@@ -6,22 +6,43 @@
 能够记住对话历史并在多轮对话中保持上下文连贯性。
 """
 
+import asyncio
 import os
+import uuid
 from typing import Annotated, Dict, List, Any
 
-from IPython.display import Image, display
-from langchain_anthropic import ChatAnthropic
 from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import (
+    AIMessageChunk,
+    BaseMessage,
+    RemoveMessage,
+    trim_messages,
+)
+import httpx
 from langchain_openai import ChatOpenAI
 from typing_extensions import TypedDict
 
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.graph import StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
 
+# 状态中保留的最大消息数，超出部分在每轮对话开始前删除
+MAX_HISTORY_MESSAGES = 20
+
+
+# 智谱模型配置，导入时从环境变量读取
+ZHIPU_MODEL = os.getenv("ZHIPU_MODEL")
+ZHIPU_API_KEY = os.getenv("ZHIPU_API_KEY")
+ZHIPU_API_URL = os.getenv("ZHIPU_API_URL")
+
+# 共享的HTTP连接池，避免每次创建模型实例都重新建立TLS连接
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=100)
+http_client = httpx.Client(limits=HTTP_LIMITS, timeout=60.0)
+http_async_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=60.0)
+
+
 def get_llm() -> ChatOpenAI:
     """
     获取语言模型实例
@@ -30,9 +51,11 @@ def get_llm() -> ChatOpenAI:
         ChatOpenAI: 配置好的语言模型实例
     """
     return ChatOpenAI(
-        model=os.getenv("ZHIPU_MODEL"),
-        openai_api_key=os.getenv("ZHIPU_API_KEY"),
-        openai_api_base=os.getenv("ZHIPU_API_URL"),
+        model=ZHIPU_MODEL,
+        openai_api_key=ZHIPU_API_KEY,
+        openai_api_base=ZHIPU_API_URL,
+        http_client=http_client,
+        http_async_client=http_async_client,
     )
 
 
@@ -46,6 +69,11 @@ class State(TypedDict):
     messages: Annotated[List[Dict[str, Any]], add_messages]
 
 
+# 配置搜索工具并绑定到语言模型，只在模块加载时执行一次
+tools = [TavilySearchResults(max_results=2)]
+llm_with_tools = get_llm().bind_tools(tools)
+
+
 def create_chat_graph() -> StateGraph:
     """
     创建聊天机器人的状态图
@@ -56,16 +84,8 @@ def create_chat_graph() -> StateGraph:
     # 初始化状态图
     graph_builder = StateGraph(State)
 
-    # 配置搜索工具
-    tool = TavilySearchResults(max_results=2)
-    tools = [tool]
-
-    # 获取语言模型并绑定工具
-    llm = get_llm()
-    llm_with_tools = llm.bind_tools(tools)
-
     # 定义聊天机器人节点函数
-    def chatbot(state: State) -> Dict[str, List[BaseMessage]]:
+    async def chatbot(state: State) -> Dict[str, List[BaseMessage]]:
         """
         聊天机器人节点函数，处理用户输入并生成回复
 
@@ -75,13 +95,43 @@ def create_chat_graph() -> StateGraph:
         返回:
             包含新消息的字典
         """
-        return {"messages": [llm_with_tools.invoke(state["messages"])]}
+        return {"messages": [await llm_with_tools.ainvoke(state["messages"])]}
+
+    # 定义历史裁剪节点函数
+    def trim_history(state: State) -> Dict[str, List[RemoveMessage]]:
+        """
+        裁剪消息历史，只保留最近的MAX_HISTORY_MESSAGES条消息
+
+        这样检查点的大小不会随对话轮数增长，传给模型的上下文也保持有界
+
+        参数:
+            state: 当前状态，包含消息历史
+
+        返回:
+            包含待删除消息的字典
+        """
+        messages = state["messages"]
+        # 从用户消息处开始截取，避免工具结果与其调用被拆开
+        kept = trim_messages(
+            messages,
+            strategy="last",
+            token_counter=len,
+            max_tokens=MAX_HISTORY_MESSAGES,
+            start_on="human",
+            include_system=True,
+        )
+        kept_ids = {m.id for m in kept}
+        return {"messages": [RemoveMessage(id=m.id) for m in messages if m.id not in kept_ids]}
+
+    # 添加历史裁剪节点
+    graph_builder.add_node("trim_history", trim_history)
+    graph_builder.add_edge("trim_history", "chatbot")
 
     # 添加聊天机器人节点
     graph_builder.add_node("chatbot", chatbot)
 
     # 添加工具节点
-    tool_node = ToolNode(tools=[tool])
+    tool_node = ToolNode(tools=tools)
     graph_builder.add_node("tools", tool_node)
 
     # 添加条件边
@@ -93,8 +143,8 @@ def create_chat_graph() -> StateGraph:
     # 添加从工具到聊天机器人的边
     graph_builder.add_edge("tools", "chatbot")
 
-    # 设置入口点
-    graph_builder.set_entry_point("chatbot")
+    # 设置入口点：每轮对话先裁剪历史，再进入聊天机器人
+    graph_builder.set_entry_point("trim_history")
 
     return graph_builder
 
@@ -115,7 +165,7 @@ def visualize_graph(graph: StateGraph) -> None:
         pass
 
 
-def run_conversation(graph: StateGraph, user_input: str, config: Dict[str, Any]) -> None:
+async def run_conversation(graph: StateGraph, user_input: str, config: Dict[str, Any]) -> None:
     """
     运行一轮对话
 
@@ -124,49 +174,53 @@ def run_conversation(graph: StateGraph, user_input: str, config: Dict[str, Any])
         user_input: 用户输入的消息
         config: 配置参数
     """
-    # 注意：config是stream()或invoke()的第二个位置参数
-    events = graph.stream(
+    # 注意：config是astream()或ainvoke()的第二个位置参数
+    # stream_mode="messages"会在LLM生成token时逐块返回
+    events = graph.astream(
         {"messages": [{"role": "user", "content": user_input}]},
         config,
-        stream_mode="values",
+        stream_mode="messages",
     )
 
-    # 打印对话结果
-    for event in events:
-        event["messages"][-1].pretty_print()
+    # 逐token打印助手回复，工具返回的消息不输出
+    print("Assistant: ", end="", flush=True)
+    async for chunk, _ in events:
+        if isinstance(chunk, AIMessageChunk):
+            print(chunk.content, end="", flush=True)
+    print()
 
 
-def main():
+async def main():
     """
     主函数，运行聊天机器人示例
     """
     # 创建状态图
     graph_builder = create_chat_graph()
 
-    # 配置内存检查点
-    # 注意：这里使用了内存检查点，适合教程演示
-    # 在生产环境中，可以改用SqliteSaver或PostgresSaver，连接到自己的数据库
-    memory = MemorySaver()
-
-    # 编译状态图
-    # 检查点比简单的聊天记忆功能强大得多
-    # 它允许随时保存和恢复复杂的状态，用于错误恢复、人机交互、时间旅行交互等
-    graph = graph_builder.compile(checkpointer=memory)
+    # 配置SQLite检查点
+    # 检查点保存在磁盘上，不会随对话增长占用进程内存
+    async with AsyncSqliteSaver.from_conn_string("checkpoints.db") as memory:
+        # 编译状态图
+        # 检查点比简单的聊天记忆功能强大得多
+        # 它允许随时保存和恢复复杂的状态，用于错误恢复、人机交互、时间旅行交互等
+        graph = graph_builder.compile(checkpointer=memory)
 
-    # 可视化状态图
-    visualize_graph(graph)
+        # 可视化状态图
+        visualize_graph(graph)
 
-    # 配置对话参数
-    config = {"configurable": {"thread_id": "1"}}
+        # 配置对话参数
+        # checkpoints.db会在多次运行之间保留，每次运行使用新的thread_id，
+        # 两轮演示对话从空白会话开始，不会接上一次运行的历史
+        config = {"configurable": {"thread_id": uuid.uuid4().hex}}
 
-    # 第一轮对话
-    user_input = "Hi there! My name is Will."
-    run_conversation(graph, user_input, config)
+        # 第一轮对话
+        user_input = "Hi there! My name is Will."
+        await run_conversation(graph, user_input, config)
 
-    # 第二轮对话，测试记忆功能
-    user_input = "Remember my name?"
-    run_conversation(graph, user_input, config)
+        # 第二轮对话，测试记忆功能
+        user_input = "Remember my name?"
+        await run_conversation(graph, user_input, config)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
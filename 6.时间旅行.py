@@ -2,7 +2,7 @@ from typing import Annotated
 
 from langchain_anthropic import ChatAnthropic
 from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import BaseMessage, RemoveMessage, trim_messages
 from typing_extensions import TypedDict
 
 from langgraph.checkpoint.memory import MemorySaver
@@ -24,13 +24,32 @@ llm = ChatAnthropic(model="claude-3-5-sonnet-20240620")
 llm_with_tools = llm.bind_tools(tools)
 
 
-def chatbot(state: State):
-    return {"messages": [llm_with_tools.invoke(state["messages"])]}
+async def chatbot(state: State):
+    return {"messages": [await llm_with_tools.ainvoke(state["messages"])]}
 
 
+MAX_HISTORY_MESSAGES = 20
+
+
+def trim_history(state: State):
+    messages = state["messages"]
+    kept = trim_messages(
+        messages,
+        strategy="last",
+        token_counter=len,
+        max_tokens=MAX_HISTORY_MESSAGES,
+        start_on="human",
+        include_system=True,
+    )
+    kept_ids = {m.id for m in kept}
+    return {"messages": [RemoveMessage(id=m.id) for m in messages if m.id not in kept_ids]}
+
+
+graph_builder.add_node("trim_history", trim_history)
 graph_builder.add_node("chatbot", chatbot)
+graph_builder.add_edge("trim_history", "chatbot")
 
-tool_node = ToolNode(tools=[tool])
+tool_node = ToolNode(tools=tools)
 graph_builder.add_node("tools", tool_node)
 
 graph_builder.add_conditional_edges(
@@ -38,7 +57,7 @@ graph_builder.add_conditional_edges(
     tools_condition,
 )
 graph_builder.add_edge("tools", "chatbot")
-graph_builder.add_edge(START, "chatbot")
+graph_builder.add_edge(START, "trim_history")
 
 memory = MemorySaver()
 graph = graph_builder.compile(checkpointer=memory)
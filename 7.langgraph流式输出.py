@@ -6,15 +6,19 @@
 
 import os
 import asyncio
-import json
-from typing import Dict, Any, TypedDict, AsyncGenerator, Optional
+import gzip
+from collections import OrderedDict
+from typing import Dict, Any, TypedDict, AsyncGenerator, List, Optional, Set, Tuple, Union
 
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from langchain_core.messages import BaseMessage
+import brotli
+import httpx
+import orjson
 from langchain_openai import ChatOpenAI
-from langgraph.graph import StateGraph, START
+from openai import AsyncOpenAI
+from sse_starlette.sse import EventSourceResponse
 import uvicorn
 
 
@@ -27,33 +31,205 @@ class StepEvent(TypedDict):
     content: Optional[str] = None
 
 
+# 环境变量只在启动时读取，请求路径上不再调用os.getenv
+ZHIPU_MODEL = os.getenv("ZHIPU_MODEL")
+ZHIPU_API_KEY = os.getenv("ZHIPU_API_KEY")
+ZHIPU_API_URL = os.getenv("ZHIPU_API_URL")
+
+# 进程内共享的HTTP连接池，所有请求复用到智谱接口的keep-alive连接；
+# 异步客户端启用HTTP/2，并发的流式请求可以复用同一条TCP连接
+HTTP_LIMITS = httpx.Limits(max_connections=256, max_keepalive_connections=64)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+http_client = httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+http_async_client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+
 def get_llm() -> ChatOpenAI:
     """获取配置好的语言模型实例"""
     return ChatOpenAI(
-        model=os.getenv("ZHIPU_MODEL"),
-        openai_api_key=os.getenv("ZHIPU_API_KEY"),
-        openai_api_base=os.getenv("ZHIPU_API_URL"),
+        model=ZHIPU_MODEL,
+        openai_api_key=ZHIPU_API_KEY,
+        openai_api_base=ZHIPU_API_URL,
+        http_client=http_client,
+        http_async_client=http_async_client,
         streaming=True
     )
 
 
-class State(TypedDict):
-    """流程状态类型定义"""
-    topic: str
-    joke: str
+# 模块加载时创建唯一的模型实例，所有请求共享其连接池
+llm = get_llm()
+
+# 流式生成直接使用openai SDK的异步客户端，省去LangChain对每个token的消息封装与回调分发；
+# 智谱接口兼容OpenAI协议，与llm共用同一个HTTP连接池
+openai_client = AsyncOpenAI(
+    base_url=ZHIPU_API_URL,
+    api_key=ZHIPU_API_KEY,
+    http_client=http_async_client,
+)
+
+
+# 工作进程数；每个进程各自持有信号量、请求合并器与笑话缓存
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "4"))
+
+# 所有工作进程合计同时进行中的LLM调用数上限，避免突发流量打满上游限流；
+# 信号量是进程内的，每个进程分得其中的一份
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "16"))
+llm_semaphore = asyncio.Semaphore(max(LLM_MAX_INFLIGHT // WEB_CONCURRENCY, 1))
+
+
+# 主题优化：在用户主题后追加的固定内容
+_TOPIC_SUFFIX = " 和猫"
+
+
+# 固定的指令放在system消息中作为公共前缀，便于模型服务复用提示词缓存；
+# 随请求变化的主题放在最后的user消息里
+_SYSTEM_PROMPT = "你是一个中文笑话生成器。要求：\n1. 简短有趣\n2. 使用中文\n3. 直接输出内容"
+_USER_PROMPT_TEMPLATE = "请生成一个关于{}的中文笑话"
+_BATCH_PROMPT_TEMPLATE = (
+    "请为以下每个主题各生成一个中文笑话，"
+    "按编号顺序输出为JSON字符串数组，不要输出任何其他内容：\n{}"
+)
+
+# /jokes接口单次请求允许的最大主题数
+_JOKES_MAX_TOPICS = 16
+
+# 请求合并：收集窗口（秒）与每批最多合并的请求数；
+# 合并后的请求不再逐字流式输出，且单独到达的请求要多等一个窗口，默认关闭，
+# 通过JOKE_BATCHING=1启用
+JOKE_BATCHING = os.getenv("JOKE_BATCHING", "") == "1"
+_BATCH_WINDOW = 0.02
+_BATCH_MAX_SIZE = 8
 
+# 内容分块合并阈值：累计字数或缓冲内容已等待的时间（秒）达到其一即发送
+_COALESCE_MAX_CHARS = 32
+_COALESCE_INTERVAL = 0.02
 
-def refine_topic(state: State) -> Dict[str, str]:
-    """主题优化处理"""
-    return {"topic": state["topic"] + " 和猫"}
+# SSE帧的固定前后缀
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+# 内容事件的固定部分，只需拼接序列化后的文本
+_SSE_CONTENT_PREFIX = b'data: {"type":"content","content":'
+_SSE_CONTENT_SUFFIX = b"}\n\n"
 
+# 生产者与写出之间缓冲的最大帧数
+_SSE_QUEUE_SIZE = 16
 
-async def stream_joke_async(topic: str) -> AsyncGenerator[StepEvent, None]:
-    """增强异常处理的流式生成"""
+# 空闲时向客户端发送keep-alive ping的间隔（秒）
+_SSE_PING_INTERVAL = 15
+
+# 按规范化主题缓存已生成笑话的内容帧，超过上限时淘汰最久未使用的条目
+_JOKE_CACHE_SIZE = 512
+_JOKE_CACHE: "OrderedDict[str, List[bytes]]" = OrderedDict()
+
+
+def joke_messages(refined_topic: str) -> List[Dict[str, str]]:
+    """构造生成笑话的对话消息"""
+    return [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": _USER_PROMPT_TEMPLATE.format(refined_topic)},
+    ]
+
+
+def batch_joke_messages(refined_topics: List[str]) -> List[Dict[str, str]]:
+    """构造一次生成多个笑话的对话消息，与单个请求共用同一system前缀"""
+    numbered = "\n".join(f"{i}. {t}" for i, t in enumerate(refined_topics, 1))
+    return [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": _BATCH_PROMPT_TEMPLATE.format(numbered)},
+    ]
+
+
+def parse_joke_list(text: str, count: int) -> List[str]:
+    """解析模型返回的JSON字符串数组，数量不符时抛出ValueError"""
+    text = text.strip()
+    # 模型有时会用```json代码块包裹输出
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    jokes = orjson.loads(text)
+    if not isinstance(jokes, list) or len(jokes) != count:
+        raise ValueError(f"期望{count}个笑话，实际返回: {text[:100]}")
+    return [str(joke) for joke in jokes]
+
+
+class JokeBatcher:
+    """
+    合并并发的笑话请求
+
+    在一个短时间窗口内收集请求的主题，窗口结束或凑满一批时发出一次LLM调用，
+    让模型按编号返回JSON数组，再把结果分发给各个等待中的请求；
+    多个请求由此分摊提示词前缀与一次往返的开销
+    """
+
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 持有后台任务的引用，防止其在完成前被垃圾回收
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, refined_topic: str) -> Optional[str]:
+        """
+        提交一个主题并等待结果
+
+        返回:
+            生成的笑话；窗口内只有这一个请求或合并调用失败时返回None，
+            由调用方自行流式生成
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((refined_topic, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if len(batch) == 1:
+            _, future = batch[0]
+            if not future.done():
+                future.set_result(None)
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        topics = [topic for topic, _ in batch]
+        try:
+            async with llm_semaphore:
+                message = await llm.ainvoke(batch_joke_messages(topics))
+            results: List[Optional[str]] = parse_joke_list(message.content, len(batch))
+        except Exception:
+            # 合并调用失败时让各请求回退为单独的流式生成
+            results = [None] * len(batch)
+        for (_, future), joke in zip(batch, results):
+            # 客户端已断开的请求，其future已被取消
+            if not future.done():
+                future.set_result(joke)
+
+
+joke_batcher = JokeBatcher(window=_BATCH_WINDOW, max_size=_BATCH_MAX_SIZE)
+
+
+async def stream_joke_async(topic: str) -> AsyncGenerator[Union[StepEvent, str], None]:
+    """
+    增强异常处理的流式生成
+
+    笑话内容直接以字符串产出，其余步骤与错误事件以StepEvent产出
+    """
+    # 上游常常一次只返回一两个字，先攒够一定字数或时间再合并成一帧发送
+    buffer: List[str] = []
+    buffered = 0
     try:
         # 第一阶段：优化主题
         yield StepEvent(type="step", stage="refine", status="start")
-        refined_topic = refine_topic({"topic": topic})["topic"]
+        refined_topic = topic + _TOPIC_SUFFIX
         yield StepEvent(
             type="step",
             stage="refine",
@@ -63,277 +239,479 @@ async def stream_joke_async(topic: str) -> AsyncGenerator[StepEvent, None]:
 
         # 第二阶段：生成笑话
         yield StepEvent(type="step", stage="generate", status="start")
-        llm = get_llm()
 
-        try:
-            async for chunk in llm.astream([
-                {"role": "user", "content": f"请生成一个关于{refined_topic}的中文笑话，要求：\n1. 简短有趣\n2. 使用中文\n3. 直接输出内容"}
-            ]):
-                if chunk.content:
-                    yield StepEvent(type="content", content=chunk.content)
-        finally:
-            # 确保最终发送完成事件
-            yield StepEvent(type="step", stage="generate", status="complete")
+        # 启用合并时与同一时间窗口内的其他请求合并为一次调用；
+        # 未启用或窗口内只有本请求时流式生成
+        joke = await joke_batcher.submit(refined_topic) if JOKE_BATCHING else None
+        if joke is not None:
+            yield joke
+        else:
+            loop = asyncio.get_running_loop()
+            # 缓冲区中最早一段内容的发送期限，缓冲区为空时为None
+            deadline: Optional[float] = None
+            async with llm_semaphore:
+                stream = await openai_client.chat.completions.create(
+                    model=ZHIPU_MODEL,
+                    messages=joke_messages(refined_topic),
+                    stream=True,
+                )
+                async with stream:
+                    chunks = stream.__aiter__()
+                    # 读取下一块放在独立任务中，等待超时只触发发送而不会中断读取
+                    next_chunk = asyncio.ensure_future(chunks.__anext__())
+                    try:
+                        while True:
+                            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                            done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+                            if done:
+                                try:
+                                    chunk = next_chunk.result()
+                                except StopAsyncIteration:
+                                    break
+                                next_chunk = asyncio.ensure_future(chunks.__anext__())
+                                delta = chunk.choices[0].delta.content if chunk.choices else None
+                                if delta:
+                                    buffer.append(delta)
+                                    buffered += len(delta)
+                                    if deadline is None:
+                                        deadline = loop.time() + _COALESCE_INTERVAL
+                            # 上游停顿时按期限发送，不等待下一块到达
+                            if buffer and (buffered >= _COALESCE_MAX_CHARS or loop.time() >= deadline):
+                                yield "".join(buffer)
+                                buffer.clear()
+                                buffered = 0
+                                deadline = None
+                    finally:
+                        next_chunk.cancel()
+
+            # 发送缓冲区中剩余的内容
+            if buffer:
+                yield "".join(buffer)
 
     except Exception as e:
+        # 先发出已生成的部分内容，再报告错误
+        if buffer:
+            yield "".join(buffer)
         yield StepEvent(type="error", content=str(e))
-        # 异常时也发送完成事件
-        yield StepEvent(type="step", stage="generate", status="complete")
+
+    # 无论成功还是失败，完成事件只发送一次
+    yield StepEvent(type="step", stage="generate", status="complete")
+
+
+async def generate_jokes(topics: List[str]) -> List[str]:
+    """
+    批量生成笑话
+
+    各主题并发调用，每次调用都经过llm_semaphore，
+    与SSE接口共用同一个在途调用上限
+    """
+    async def generate_one(topic: str) -> str:
+        async with llm_semaphore:
+            message = await llm.ainvoke(joke_messages(topic + _TOPIC_SUFFIX))
+        return message.content
+
+    return await asyncio.gather(*(generate_one(t) for t in topics))
+
 
 app = FastAPI(
     title="最终版中文笑话生成API",
     description="修复所有前端报错版本",
-    version="1.3.0"
+    version="1.3.0",
+    default_response_class=ORJSONResponse,
 )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# 首页由本服务同源提供，默认不启用CORS中间件，避免它包装每一次SSE写出；
+# 需要跨域访问时，通过CORS_ALLOW_ORIGINS配置逗号分隔的来源列表
+CORS_ALLOW_ORIGINS = [o.strip() for o in os.getenv("CORS_ALLOW_ORIGINS", "").split(",") if o.strip()]
+if CORS_ALLOW_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ALLOW_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["GET"],
+        allow_headers=["*"],
+        max_age=86400,
+    )
 
 
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    return """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>中文笑话生成器 - 最终版</title>
-        <meta charset="UTF-8">
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                max-width: 800px;
-                margin: 0 auto;
-                padding: 20px;
-                background-color: #f5f5f5;
-            }
-            h1 {
-                color: #333;
-                text-align: center;
-                margin-bottom: 30px;
-            }
-            .container {
-                background: white;
-                padding: 25px;
-                border-radius: 12px;
-                box-shadow: 0 3px 6px rgba(0,0,0,0.1);
-            }
-            .input-group {
-                margin-bottom: 25px;
-                display: flex;
-                gap: 10px;
-            }
-            input[type="text"] {
-                flex: 1;
-                padding: 12px;
-                border: 2px solid #ddd;
-                border-radius: 6px;
-                font-size: 16px;
-                transition: border-color 0.3s;
-            }
-            input[type="text"]:focus {
-                outline: none;
-                border-color: #4CAF50;
-            }
-            button {
-                padding: 12px 25px;
-                background: linear-gradient(135deg, #4CAF50, #45a049);
-                color: white;
-                border: none;
-                border-radius: 6px;
-                cursor: pointer;
-                font-size: 16px;
-                transition: transform 0.2s;
-            }
-            button:hover {
-                transform: translateY(-2px);
-            }
-            #status {
-                margin: 20px 0;
-                padding: 15px;
-                background: #f8f8f8;
-                border-radius: 8px;
-            }
-            .status-item {
-                margin: 12px 0;
-                padding: 10px;
-                background: white;
-                border-left: 4px solid #4CAF50;
-                border-radius: 4px;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-                transition: all 0.3s ease;
-            }
-            #result {
-                min-height: 120px;
-                padding: 20px;
-                background: #fff9f9;
-                border-radius: 8px;
-                border: 2px solid #eee;
-                font-size: 18px;
-                line-height: 1.6;
-                white-space: pre-wrap;
-                transition: background 0.3s;
-            }
-            @keyframes fadeIn {
-                from { opacity: 0; }
-                to { opacity: 1; }
-            }
-            .typing-effect {
-                animation: fadeIn 0.1s ease-in;
-            }
-            .error {
-                border-color: #ff4444 !important;
-                background: #fff0f0;
-            }
-        </style>
-    </head>
-    <body>
-        <h1>📚 中文笑话生成器 - 最终版</h1>
-        <div class="container">
-            <div class="input-group">
-                <input type="text" id="topic" placeholder="请输入笑话主题" value="兔子">
-                <button onclick="generateJoke()">🚀 生成笑话</button>
-            </div>
-            
-            <div id="status"></div>
-            <div id="result"></div>
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    """关闭共享的HTTP连接池"""
+    await http_async_client.aclose()
+    http_client.close()
+
+
+# 首页HTML在模块加载时编码为字节，每次请求直接复用
+_INDEX_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>中文笑话生成器 - 最终版</title>
+    <meta charset="UTF-8">
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 20px;
+            background-color: #f5f5f5;
+        }
+        h1 {
+            color: #333;
+            text-align: center;
+            margin-bottom: 30px;
+        }
+        .container {
+            background: white;
+            padding: 25px;
+            border-radius: 12px;
+            box-shadow: 0 3px 6px rgba(0,0,0,0.1);
+        }
+        .input-group {
+            margin-bottom: 25px;
+            display: flex;
+            gap: 10px;
+        }
+        input[type="text"] {
+            flex: 1;
+            padding: 12px;
+            border: 2px solid #ddd;
+            border-radius: 6px;
+            font-size: 16px;
+            transition: border-color 0.3s;
+        }
+        input[type="text"]:focus {
+            outline: none;
+            border-color: #4CAF50;
+        }
+        button {
+            padding: 12px 25px;
+            background: linear-gradient(135deg, #4CAF50, #45a049);
+            color: white;
+            border: none;
+            border-radius: 6px;
+            cursor: pointer;
+            font-size: 16px;
+            transition: transform 0.2s;
+        }
+        button:hover {
+            transform: translateY(-2px);
+        }
+        #status {
+            margin: 20px 0;
+            padding: 15px;
+            background: #f8f8f8;
+            border-radius: 8px;
+        }
+        .status-item {
+            margin: 12px 0;
+            padding: 10px;
+            background: white;
+            border-left: 4px solid #4CAF50;
+            border-radius: 4px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
+            transition: all 0.3s ease;
+        }
+        #result {
+            min-height: 120px;
+            padding: 20px;
+            background: #fff9f9;
+            border-radius: 8px;
+            border: 2px solid #eee;
+            font-size: 18px;
+            line-height: 1.6;
+            white-space: pre-wrap;
+            transition: background 0.3s;
+        }
+        .error {
+            border-color: #ff4444 !important;
+            background: #fff0f0;
+        }
+    </style>
+</head>
+<body>
+    <h1>📚 中文笑话生成器 - 最终版</h1>
+    <div class="container">
+        <div class="input-group">
+            <input type="text" id="topic" placeholder="请输入笑话主题" value="兔子">
+            <button onclick="generateJoke()">🚀 生成笑话</button>
         </div>
 
-        <script>
-            function generateJoke() {
-                let isProcessCompleted = false;  // 新增完成状态标志
-                const topic = document.getElementById('topic').value;
-                const resultDiv = document.getElementById('result');
-                const statusDiv = document.getElementById('status');
-                
-                // 初始化显示
-                resultDiv.innerHTML = '';
-                statusDiv.innerHTML = `
-                    <div class="status-item" id="refine_status">📝 等待开始...</div>
-                    <div class="status-item" id="generate_status">📝 等待开始...</div>
-                `;
-
-                const eventSource = new EventSource(`/joke/sse?topic=${encodeURIComponent(topic)}`);
-                
-                eventSource.onmessage = function(event) {
-                    const data = JSON.parse(event.data);
-                    if (data.type === 'step' && data.status === 'complete' && data.stage === 'generate') {
-                        isProcessCompleted = true;
-                    }
-                    
-                    switch(data.type) {
-                        case 'step':
-                            if (data.status === 'complete') {
-                                isProcessCompleted = true;  // 标记流程完成
-                            }
-                            handleStepEvent(data);
-                            break;
-                        case 'content':
-                            appendContent(data.content);
-                            break;
-                        case 'error':
-                            showError(data.content);
-                            eventSource.close();
-                            break;
-                    }
-                };
-
-                eventSource.onerror = function() {
-                    eventSource.close();
+        <div id="status"></div>
+        <div id="result"></div>
+    </div>
+
+    <script>
+        // 当前的SSE连接，同一时间只保留一个
+        let eventSource = null;
+
+        function generateJoke() {
+            let isProcessCompleted = false;  // 新增完成状态标志
+            const topic = document.getElementById('topic').value;
+            const resultDiv = document.getElementById('result');
+            const statusDiv = document.getElementById('status');
+
+            // 初始化显示
+            resultDiv.innerHTML = '';
+            statusDiv.innerHTML = `
+                <div class="status-item" id="refine_status">📝 等待开始...</div>
+                <div class="status-item" id="generate_status">📝 等待开始...</div>
+            `;
+
+            // 关闭上一次未结束的连接，服务端检测到断开后会取消对应的生成任务
+            if (eventSource) {
+                eventSource.close();
+            }
+            const source = new EventSource(`/joke/sse?topic=${encodeURIComponent(topic)}`);
+            eventSource = source;
+
+            source.onmessage = function(event) {
+                const data = JSON.parse(event.data);
+                if (data.type === 'step' && data.status === 'complete' && data.stage === 'generate') {
+                    isProcessCompleted = true;
+                    // 生成结束后主动关闭，避免浏览器自动重连再次触发生成
+                    source.close();
+                }
 
-                    // 仅当流程未完成时显示错误
-                    if (!isProcessCompleted) {
-                        const generateStatus = document.getElementById('generate_status');
-                        if (generateStatus) {
-                            generateStatus.innerHTML = '❌ 连接意外中断';
-                            generateStatus.style.color = '#ff4444';
+                switch(data.type) {
+                    case 'step':
+                        if (data.status === 'complete') {
+                            isProcessCompleted = true;  // 标记流程完成
                         }
-                    }
+                        handleStepEvent(data);
+                        break;
+                    case 'content':
+                        appendContent(data.content);
+                        break;
+                    case 'error':
+                        showError(data.content);
+                        source.close();
+                        break;
+                }
+            };
+
+            source.onerror = function() {
+                source.close();
 
-                    // 修复报错：直接操作DOM而不是调用未定义的updateStatus
+                // 仅当流程未完成时显示错误
+                if (!isProcessCompleted) {
                     const generateStatus = document.getElementById('generate_status');
                     if (generateStatus) {
                         generateStatus.innerHTML = '❌ 连接意外中断';
                         generateStatus.style.color = '#ff4444';
                     }
-                };
-            }
+                }
 
-            function handleStepEvent(data) {
-                const element = document.getElementById(`${data.stage}_status`);
-                if (!element) {
-                    console.error('状态元素未找到:', data.stage);
-                    return;
+                // 修复报错：直接操作DOM而不是调用未定义的updateStatus
+                const generateStatus = document.getElementById('generate_status');
+                if (generateStatus) {
+                    generateStatus.innerHTML = '❌ 连接意外中断';
+                    generateStatus.style.color = '#ff4444';
                 }
+            };
+        }
 
-                const statusMap = {
-                    start: { icon: '🔄', color: '#666', text: '进行中...' },
-                    complete: { icon: '✅', color: '#4CAF50', text: '已完成' },
-                    error: { icon: '❌', color: '#ff4444', text: '失败' }
-                };
-
-                const statusInfo = statusMap[data.status] || {};
-                element.innerHTML = `
-                    ${statusInfo.icon || ''} ${stageToText(data.stage)} ${statusInfo.text || ''}
-                    ${data.result ? `<br><small style="color: #666;">优化结果：${data.result}</small>` : ''}
-                `;
-                element.style.color = statusInfo.color || '#666';
+        function handleStepEvent(data) {
+            const element = document.getElementById(`${data.stage}_status`);
+            if (!element) {
+                console.error('状态元素未找到:', data.stage);
+                return;
             }
 
-            function stageToText(stage) {
-                return {
-                    'refine': '主题优化',
-                    'generate': '笑话生成'
-                }[stage] || stage;
-            }
+            const statusMap = {
+                start: { icon: '🔄', color: '#666', text: '进行中...' },
+                complete: { icon: '✅', color: '#4CAF50', text: '已完成' },
+                error: { icon: '❌', color: '#ff4444', text: '失败' }
+            };
+
+            const statusInfo = statusMap[data.status] || {};
+            element.innerHTML = `
+                ${statusInfo.icon || ''} ${stageToText(data.stage)} ${statusInfo.text || ''}
+                ${data.result ? `<br><small style="color: #666;">优化结果：${data.result}</small>` : ''}
+            `;
+            element.style.color = statusInfo.color || '#666';
+        }
 
-            function appendContent(content) {
-                const resultDiv = document.getElementById('result');
-                const span = document.createElement('span');
-                span.className = 'typing-effect';
-                span.textContent = content;
-                resultDiv.appendChild(span);
-                resultDiv.scrollTop = resultDiv.scrollHeight;
-            }
+        function stageToText(stage) {
+            return {
+                'refine': '主题优化',
+                'generate': '笑话生成'
+            }[stage] || stage;
+        }
 
-            function showError(message) {
-                const statusDiv = document.getElementById('status');
-                statusDiv.innerHTML += `
-                    <div class="status-item error">
-                        ❌ 错误：${message}
-                    </div>
-                `;
-            }
-        </script>
-    </body>
-    </html>
-    """
+        function appendContent(content) {
+            const resultDiv = document.getElementById('result');
+            // 直接追加文本，不为每个分块创建新的DOM节点
+            resultDiv.insertAdjacentText('beforeend', content);
+            resultDiv.scrollTop = resultDiv.scrollHeight;
+        }
+
+        function showError(message) {
+            const statusDiv = document.getElementById('status');
+            statusDiv.innerHTML += `
+                <div class="status-item error">
+                    ❌ 错误：${message}
+                </div>
+            `;
+        }
+    </script>
+</body>
+</html>
+""".encode("utf-8")
+
+
+def _index_response(body: bytes, encoding: Optional[str] = None) -> Response:
+    """构建首页响应，encoding为body所用的压缩编码"""
+    headers = {"Cache-Control": "public, max-age=3600", "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="text/html; charset=utf-8", headers=headers)
+
+
+# 启动时预先压缩首页，并为每种编码构建一次响应对象；
+# 响应不含任何请求相关的状态，可以安全复用
+_INDEX_RESPONSE = _index_response(_INDEX_HTML)
+_INDEX_RESPONSE_BR = _index_response(brotli.compress(_INDEX_HTML, quality=11), "br")
+_INDEX_RESPONSE_GZIP = _index_response(gzip.compress(_INDEX_HTML, 9), "gzip")
+
+
+def _accepted_encodings(header: str) -> Set[str]:
+    """解析Accept-Encoding头，返回客户端接受的编码；q=0表示明确拒绝"""
+    accepted = set()
+    listed = set()
+    for item in header.lower().split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip()
+        if not coding:
+            continue
+        listed.add(coding)
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(coding)
+    # "*"代表未单独列出的编码
+    if "*" in accepted:
+        accepted.update(c for c in ("br", "gzip") if c not in listed)
+    return accepted
+
+
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request) -> Response:
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    if "br" in accepted:
+        return _INDEX_RESPONSE_BR
+    if "gzip" in accepted:
+        return _INDEX_RESPONSE_GZIP
+    return _INDEX_RESPONSE
 
 
 @app.get("/joke/sse")
 async def joke_stream(topic: str = "兔子"):
     """SSE流式接口"""
-    return StreamingResponse(
-        sse_generator(topic),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
-    )
+    # EventSourceResponse默认带有禁止缓存与X-Accel-Buffering等头部，并定期发送keep-alive ping；
+    # sse_generator产出的已是完整的SSE帧字节，会原样写出
+    return EventSourceResponse(sse_generator(topic), ping=_SSE_PING_INTERVAL)
+
+
+@app.get("/jokes")
+async def batch_jokes(topics: str) -> Dict[str, List[str]]:
+    """批量生成接口，topics为逗号分隔的主题列表"""
+    topic_list = [t.strip() for t in topics.split(",") if t.strip()]
+    if len(topic_list) > _JOKES_MAX_TOPICS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一次最多生成{_JOKES_MAX_TOPICS}个主题，实际为{len(topic_list)}个"
+        )
+    return {"jokes": await generate_jokes(topic_list)}
+
+
+def encode_sse(event: Union[StepEvent, str]) -> bytes:
+    """将事件编码为一帧SSE数据"""
+    # orjson直接输出UTF-8字节，响应无需再次编码
+    if isinstance(event, str):
+        # 内容事件最频繁，跳过字典构造，只对文本做JSON转义
+        return _SSE_CONTENT_PREFIX + orjson.dumps(event) + _SSE_CONTENT_SUFFIX
+    return _SSE_PREFIX + orjson.dumps(event) + _SSE_SUFFIX
+
 
+async def sse_generator(topic: str) -> AsyncGenerator[bytes, None]:
+    """
+    SSE格式转换
+
+    后台任务读取LLM输出并编码成帧放入有界队列，本生成器只负责取帧写出，
+    使等待上游token与向客户端写数据可以交叠进行；
+    成功生成的内容帧按规范化主题缓存，相同主题的后续请求直接回放
+    """
+    cache_key = topic.strip().lower()
+    cached = _JOKE_CACHE.get(cache_key)
+    if cached is not None:
+        # 命中缓存：回放已编码的内容帧，不再调用LLM；
+        # 缓存键经过规范化，步骤事件按本次请求的原始主题重新生成
+        _JOKE_CACHE.move_to_end(cache_key)
+        yield encode_sse(StepEvent(type="step", stage="refine", status="start"))
+        yield encode_sse(StepEvent(
+            type="step",
+            stage="refine",
+            status="complete",
+            result=topic + _TOPIC_SUFFIX
+        ))
+        yield encode_sse(StepEvent(type="step", stage="generate", status="start"))
+        for frame in cached:
+            yield frame
+            await asyncio.sleep(0)
+        yield encode_sse(StepEvent(type="step", stage="generate", status="complete"))
+        return
+
+    queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue(maxsize=_SSE_QUEUE_SIZE)
+
+    async def produce() -> None:
+        frames: List[bytes] = []
+        failed = False
+        try:
+            async for event in stream_joke_async(topic):
+                if isinstance(event, dict) and event["type"] == "error":
+                    failed = True
+                frame = encode_sse(event)
+                if isinstance(event, str):
+                    frames.append(frame)
+                await queue.put(frame)
+            # 只缓存完整成功的结果
+            if not failed:
+                _JOKE_CACHE[cache_key] = frames
+                if len(_JOKE_CACHE) > _JOKE_CACHE_SIZE:
+                    _JOKE_CACHE.popitem(last=False)
+        finally:
+            # 被取消说明客户端已断开，无需放入结束标记
+            if not asyncio.current_task().cancelling():
+                await queue.put(None)
 
-async def sse_generator(topic: str) -> AsyncGenerator[str, None]:
-    """SSE格式转换"""
-    async for event in stream_joke_async(topic):
-        yield f"data: {json.dumps(event)}\n\n"
-        await asyncio.sleep(0.03)
+    producer = asyncio.create_task(produce())
+    try:
+        while (frame := await queue.get()) is not None:
+            yield frame
+        # 生产者若因异常结束，在此重新抛出
+        await producer
+    finally:
+        # 客户端断开时取消生产者，进而关闭上游的LLM流
+        producer.cancel()
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # 多进程模式要求以导入字符串传入应用；本文件名不是合法的模块名，
+    # 因此使用"__main__:app"，子进程（spawn方式）会重新加载本脚本
+    uvicorn.run(
+        "__main__:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=WEB_CONCURRENCY,
+        # 比浏览器与常见反向代理的空闲超时更长，避免复用中的连接被服务端先关闭
+        timeout_keep_alive=75,
+    )